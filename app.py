@@ -1,12 +1,17 @@
 
 import io
+import posixpath
 import re
+import zipfile
+import xml.etree.ElementTree as ET
 from datetime import datetime
 from pathlib import Path
+from xml.sax.saxutils import escape
 
+import numpy as np
 import pandas as pd
+import requests
 import streamlit as st
-from openpyxl import load_workbook
 
 st.set_page_config(page_title="Walmart Price Update", layout="wide")
 st.title("Walmart Price Update Tool")
@@ -25,6 +30,21 @@ COLS_PRICE = ["E", "F", "G"]
 
 MAX_ROWS = 1000
 
+_XLSX_NS = {
+    "main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+
+_ROW_START_RE = re.compile(r'<row r="(\d+)"')
+_DIMENSION_RE = re.compile(r'(<dimension ref="[A-Z]+\d+:[A-Z]+)(\d+)"')
+# Control characters that are not allowed anywhere in XML 1.0 (e.g. stray \x0b pasted from Excel).
+_XML_ILLEGAL_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+# Thousands separators and currency symbols that users paste along with prices.
+_PRICE_JUNK_RE = re.compile(r"[,₹$]")
+_BAD_FILENAME_CHARS_RE = re.compile(r"[^\w\- ]+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
 def extract_sheet_id(sheet_url: str) -> str:
     try:
         parts = sheet_url.split("/d/")
@@ -42,78 +62,127 @@ def build_csv_export_url(sheet_url: str) -> str:
         return ""
     return f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv"
 
+@st.cache_resource
+def http_session() -> requests.Session:
+    # Streamlit re-runs the whole script on every interaction, so keep one pooled session per process.
+    return requests.Session()
+
 @st.cache_data(ttl=1800)
 def load_status_sheet(csv_url: str) -> pd.DataFrame:
-    return pd.read_csv(csv_url)
+    resp = http_session().get(csv_url, timeout=30)
+    resp.raise_for_status()
 
-def normalize_sku(s) -> str:
-    if s is None:
-        return ""
-    s = str(s).strip()
-    if s.lower() in {"nan", "none"}:
-        return ""
-    return s
+    # Check the header first so a wrong sheet (or Google's login page) gets a readable error.
+    required = [GSHEET_SKU_COL, GSHEET_STATUS_COL, GSHEET_PRICE_COL]
+    header = pd.read_csv(io.BytesIO(resp.content), nrows=0).columns
+    if not set(required).issubset(header):
+        raise ValueError(f"Google Sheet must have columns: {', '.join(required)}")
+
+    # C engine: it applies the string dtype while parsing, so SKUs like 0012 keep their leading zeros.
+    return pd.read_csv(
+        io.BytesIO(resp.content),
+        usecols=required,
+        dtype={GSHEET_SKU_COL: "string[pyarrow]", GSHEET_STATUS_COL: "string[pyarrow]"},
+        engine="c",
+        dtype_backend="pyarrow",
+    )
+
+def normalize_sku_series(skus: pd.Series) -> pd.Series:
+    skus = skus.astype("string[pyarrow]").fillna("").str.strip()
+    return skus.mask(skus.str.lower().isin({"nan", "none"}), "")
 
-def is_unpublished(status_val) -> bool:
+def unpublished_mask(status: pd.Series) -> pd.Series:
     # Any status containing 'unpublished' (case-insensitive) is treated as unpublished.
-    if status_val is None:
-        return False
-    s = str(status_val).strip().lower()
-    return "unpublished" in s
+    return status.str.contains("unpublished", case=False, na=False, regex=False)
 
 def sanitize_filename(name: str) -> str:
     name = (name or "").strip()
     if not name:
         return ""
-    name = re.sub(r"[^\w\- ]+", "", name)
-    name = re.sub(r"\s+", "_", name)
-    return name
+    return _WHITESPACE_RE.sub("_", _BAD_FILENAME_CHARS_RE.sub("", name))
 
 def clean_price_series(price_series: pd.Series) -> pd.Series:
-    raw = price_series.copy()
-    raw = raw.where(~raw.isna(), "")
-    raw = raw.astype(str).str.strip()
-    raw = raw.str.replace(",", "", regex=False)
-    raw = raw.str.replace("₹", "", regex=False)
-    raw = raw.str.replace("$", "", regex=False)
+    if pd.api.types.is_numeric_dtype(price_series):
+        return pd.to_numeric(price_series, errors="coerce")
+    raw = price_series.where(price_series.notna(), "").astype(str).str.strip()
+    raw = raw.str.replace(_PRICE_JUNK_RE, "", regex=True)
     return pd.to_numeric(raw, errors="coerce")
 
-def fill_price_template(df: pd.DataFrame):
-    wb = load_workbook(TEMPLATE_PATH)
-    ws = wb.active
-
-    max_rows_to_clear = max(ws.max_row, START_ROW + len(df) + 50)
-    for r in range(START_ROW, max_rows_to_clear + 1):
-        ws[f"{COL_SKU}{r}"].value = None
-        for c in COLS_PRICE:
-            ws[f"{c}{r}"].value = None
-
-    for i, row in enumerate(df.itertuples(index=False), start=0):
-        r = START_ROW + i
-        sku = str(row.SKU).strip()
-        price = float(row.New_Price)
-        ws[f"{COL_SKU}{r}"].value = sku
-        for c in COLS_PRICE:
-            ws[f"{c}{r}"].value = price
+def active_sheet_part(parts: dict) -> str:
+    # Same sheet openpyxl's wb.active gives: workbookView activeTab -> <sheet> r:id -> rels target.
+    workbook = ET.fromstring(parts["xl/workbook.xml"])
+    view = workbook.find("main:bookViews/main:workbookView", _XLSX_NS)
+    active_tab = int(view.get("activeTab", 0)) if view is not None else 0
+    sheets = workbook.findall("main:sheets/main:sheet", _XLSX_NS)
+    rel_id = sheets[active_tab].get(f"{{{_XLSX_NS['r']}}}id")
+
+    rels = ET.fromstring(parts["xl/_rels/workbook.xml.rels"])
+    target = next(rel.get("Target") for rel in rels.findall("rel:Relationship", _XLSX_NS) if rel.get("Id") == rel_id)
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join("xl", target))
+
+@st.cache_resource
+def load_template_parts():
+    # The template is static: read the archive and pre-split the sheet XML once per process
+    # so each download is just string concatenation plus a zip write.
+    with zipfile.ZipFile(TEMPLATE_PATH) as zin:
+        parts = [(name, zin.read(name)) for name in zin.namelist()]
+    sheet_name = active_sheet_part(dict(parts))
+    sheet_xml = dict(parts)[sheet_name].decode("utf-8")
+    # An empty template sheet may store its data as a self-closing <sheetData/>.
+    sheet_xml = re.sub(r"<sheetData\s*/>", "<sheetData></sheetData>", sheet_xml, count=1)
+    head, tail = sheet_xml.split("</sheetData>", 1)
+    # Rows are stored in ascending order, so only cut when the template actually has stale data rows.
+    stale = next((m.start() for m in _ROW_START_RE.finditer(head) if int(m.group(1)) >= START_ROW), None)
+    if stale is not None:
+        head = head[:stale]
+    return parts, sheet_name, head, tail
+
+@st.cache_data(max_entries=20)
+def fill_price_template(df: pd.DataFrame) -> bytes:
+    # Patch the sheet XML directly instead of round-tripping the workbook through openpyxl:
+    # data rows are streamed into the sheet part and every other part is copied verbatim.
+    # Cached on the writable rows, so reruns that don't change them reuse the generated file.
+    parts, sheet_name, head, tail = load_template_parts()
+
+    last_row = START_ROW + len(df) - 1
+    head = _DIMENSION_RE.sub(lambda m: f'{m.group(1)}{max(int(m.group(2)), last_row)}"', head, count=1)
 
     out = io.BytesIO()
-    wb.save(out)
-    out.seek(0)
-    return out
-
-def validate_for_download(df: pd.DataFrame):
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+        for name, data in parts:
+            if name != sheet_name:
+                zout.writestr(name, data)
+                continue
+            with zout.open(name, "w") as sheet:
+                sheet.write(head.encode("utf-8"))
+                for i, (sku, price) in enumerate(df[["SKU", "New_Price"]].to_numpy(), start=0):
+                    r = START_ROW + i
+                    sku = escape(_XML_ILLEGAL_RE.sub("", str(sku)).strip())
+                    value = repr(float(price))
+                    price_cells = "".join(f'<c r="{c}{r}"><v>{value}</v></c>' for c in COLS_PRICE)
+                    row = f'<row r="{r}"><c r="{COL_SKU}{r}" t="inlineStr"><is><t>{sku}</t></is></c>{price_cells}</row>'
+                    sheet.write(row.encode("utf-8"))
+                sheet.write(("</sheetData>" + tail).encode("utf-8"))
+    return out.getvalue()
+
+def clean_table(df: pd.DataFrame) -> pd.DataFrame:
+    # Normalized SKU + numeric New Price for the rows the user actually filled in.
+    # Computed once per rerun and shared by Quick info and validate_for_download.
+    sku = normalize_sku_series(df["SKU"])
+    price_num = clean_price_series(df["New Price"])
+    filled = (sku != "") | (~price_num.isna())
+    # Publish Status only takes a handful of values, so status checks run on the categories.
+    status = df["Publish Status"][filled].fillna("").astype("category")
+    return pd.DataFrame({"SKU": sku[filled], "New_Price_num": price_num[filled], "Publish Status": status})
+
+def validate_for_download(nonblank: pd.DataFrame):
+    # Expects the output of clean_table.
     # Hard Fail rules: blank SKU, invalid new price, duplicate SKU, SKU Not Found.
     # Soft Fail: Unpublished SKU -> needs confirmation checkbox.
     hard_errors = []
-    if df is None or df.empty:
-        return ["No rows found."], [], [], pd.DataFrame()
-
-    d = df.copy()
-    d["SKU"] = d["SKU"].apply(normalize_sku)
-    d["New_Price_num"] = clean_price_series(d["New Price"])
-
-    nonblank = d[(d["SKU"] != "") | (~d["New_Price_num"].isna())].copy()
-    if nonblank.empty:
+    if nonblank is None or nonblank.empty:
         return ["All rows are blank."], [], [], pd.DataFrame()
 
     if (nonblank["SKU"] == "").any():
@@ -123,60 +192,47 @@ def validate_for_download(df: pd.DataFrame):
     if (nonblank["New_Price_num"] <= 0).any():
         hard_errors.append("Some New Price values are 0 or negative.")
 
-    not_found_mask = nonblank["Publish Status"].astype(str).str.strip().eq("SKU Not Found")
+    not_found_mask = nonblank["Publish Status"].eq("SKU Not Found")
     not_found_skus = nonblank.loc[not_found_mask, "SKU"].tolist()
     if not_found_skus:
         hard_errors.append(f"SKU Not Found on Walmart: {len(not_found_skus)}")
 
-    dupes = nonblank[nonblank["SKU"] != ""].loc[nonblank["SKU"].duplicated(keep=False), "SKU"].unique().tolist()
+    sku_counts = nonblank.loc[nonblank["SKU"] != "", "SKU"].value_counts()
+    dupes = sku_counts.index[sku_counts > 1].tolist()
     if dupes:
         hard_errors.append(f"Duplicate SKU found: {len(dupes)}")
 
-    unpublished_mask = nonblank["Publish Status"].apply(is_unpublished)
-    unpublished_skus = nonblank.loc[unpublished_mask & (~not_found_mask), "SKU"].tolist()
+    unpublished = unpublished_mask(nonblank["Publish Status"])
+    unpublished_skus = nonblank.loc[unpublished & (~not_found_mask), "SKU"].tolist()
 
-    writable = nonblank[
-        (nonblank["SKU"] != "")
-        & (~nonblank["New_Price_num"].isna())
-        & (nonblank["New_Price_num"] > 0)
-        & (~not_found_mask)
-    ].copy()
+    # Combine into one bool buffer in place; the SKU check stays on the Arrow column.
+    price = nonblank["New_Price_num"].to_numpy(dtype=float, na_value=np.nan)
+    writable = nonblank["SKU"].ne("").to_numpy(dtype=bool)
+    writable &= price > 0  # NaN compares False, so this also drops missing prices
+    writable &= ~not_found_mask.to_numpy(dtype=bool)
 
-    writable_out = writable[["SKU", "New_Price_num"]].copy()
-    writable_out.columns = ["SKU", "New_Price"]
+    writable_out = pd.DataFrame({"SKU": nonblank.loc[writable, "SKU"], "New_Price": nonblank.loc[writable, "New_Price_num"]})
     return hard_errors, not_found_skus, unpublished_skus, writable_out
 
 def apply_status_lookup(input_df: pd.DataFrame, status_df: pd.DataFrame):
-    out = input_df.copy()
-    out["SKU"] = out["SKU"].apply(normalize_sku)
-
-    required = {GSHEET_SKU_COL, GSHEET_STATUS_COL, GSHEET_PRICE_COL}
-    if not required.issubset(set(status_df.columns)):
-        raise ValueError(f"Google Sheet must have columns: {', '.join(required)}")
-
-    status_df = status_df.copy()
-    status_df[GSHEET_SKU_COL] = status_df[GSHEET_SKU_COL].apply(normalize_sku)
-    status_df = status_df[status_df[GSHEET_SKU_COL] != ""].drop_duplicates(subset=[GSHEET_SKU_COL], keep="last")
-
-    status_map = dict(zip(status_df[GSHEET_SKU_COL], status_df[GSHEET_STATUS_COL].astype(str)))
-    price_map = dict(zip(status_df[GSHEET_SKU_COL], status_df[GSHEET_PRICE_COL]))
-
-    def get_status(sku: str) -> str:
-        if not sku:
-            return ""
-        return str(status_map.get(sku, "SKU Not Found"))
-
-    def get_curr_price(sku: str):
-        if not sku:
-            return ""
-        val = price_map.get(sku, "")
-        if pd.isna(val):
-            return ""
-        return val
-
-    out["Publish Status"] = out["SKU"].apply(get_status)
-    out["Current Price"] = out["SKU"].apply(get_curr_price)
-    return out
+    sku = normalize_sku_series(input_df["SKU"])
+    blank = sku.eq("")
+    if blank.all():
+        # Fresh or cleared table: nothing to look up.
+        status = pd.Series(pd.array([""] * len(sku), dtype="string[pyarrow]"), index=input_df.index)
+        return input_df.assign(**{"SKU": sku, "Publish Status": status, "Current Price": ""})
+
+    sheet_sku = normalize_sku_series(status_df[GSHEET_SKU_COL])
+    keep = (sheet_sku != "") & (~sheet_sku.duplicated(keep="last"))
+    lookup_index = pd.Index(sheet_sku[keep])
+    status_lookup = pd.Series(status_df.loc[keep, GSHEET_STATUS_COL].astype("string[pyarrow]").array, index=lookup_index)
+    price_lookup = pd.Series(status_df.loc[keep, GSHEET_PRICE_COL].astype(object).to_numpy(), index=lookup_index)
+
+    found = sku.isin(lookup_index)
+    status = sku.map(status_lookup).where(found, "SKU Not Found").mask(blank, "")
+    curr_price = sku.map(price_lookup)
+    curr_price = curr_price.where(curr_price.notna(), "")
+    return input_df.assign(**{"SKU": sku, "Publish Status": status, "Current Price": curr_price})
 
 with st.sidebar:
     st.header("Settings")
@@ -202,7 +258,12 @@ row_count = st.number_input("Rows", min_value=1, max_value=MAX_ROWS, value=10, s
 st.caption("Tip: Copy 2 columns (SKU and New Price) from Excel and paste directly into the table.")
 
 def empty_table(n: int) -> pd.DataFrame:
-    return pd.DataFrame({"SKU": [""] * n, "New Price": [""] * n, "Publish Status": [""] * n, "Current Price": [""] * n})
+    return pd.DataFrame({
+        "SKU": pd.array([""] * n, dtype="string[pyarrow]"),
+        "New Price": [""] * n,
+        "Publish Status": pd.array([""] * n, dtype="string[pyarrow]"),
+        "Current Price": [""] * n,
+    })
 
 if "table_df" not in st.session_state:
     st.session_state.table_df = empty_table(int(row_count))
@@ -234,16 +295,16 @@ with col_left:
     )
     st.session_state.table_df = edited
 
+filled_rows = clean_table(edited)
+
 with col_right:
     st.markdown("### Quick info")
-    tmp = edited.copy()
-    tmp["SKU"] = tmp["SKU"].apply(normalize_sku)
-    tmp["New_Price_num"] = clean_price_series(tmp["New Price"])
-    tmp_nonblank = tmp[(tmp["SKU"] != "") | (~tmp["New_Price_num"].isna())].copy()
-    st.metric("Rows filled", int(len(tmp_nonblank)))
+    st.metric("Rows filled", int(len(filled_rows)))
 
-    nf_count = int((tmp_nonblank["Publish Status"].astype(str).str.strip() == "SKU Not Found").sum())
-    unpub_count = int(tmp_nonblank["Publish Status"].apply(is_unpublished).sum())
+    # One counting pass over the category codes; both counts come from the per-status totals.
+    status_counts = filled_rows["Publish Status"].value_counts()
+    nf_count = int(status_counts.get("SKU Not Found", 0))
+    unpub_count = int(status_counts[unpublished_mask(status_counts.index.to_series()).to_numpy()].sum())
 
     if nf_count > 0:
         st.error(f"{nf_count} SKU Not Found")
@@ -281,7 +342,7 @@ today = datetime.now().strftime("%Y%m%d")
 default_name = f"walmart_price_update_{today}"
 custom_name = st.text_input("Download file name (editable)", value=default_name)
 
-hard_errors, not_found_skus, unpublished_skus, writable_out = validate_for_download(st.session_state.table_df)
+hard_errors, not_found_skus, unpublished_skus, writable_out = validate_for_download(filled_rows)
 
 with st.sidebar:
     st.divider()